@@ -1,10 +1,29 @@
 import streamlit as st
 import os
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import re
+import hashlib
+import orjson
 import time
-from json.decoder import JSONDecodeError
+import uuid
+from pathlib import Path
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Linear-time RE2 engine for the JSON-recovery and placeholder scans when available
+try:
+    import re2
+except ImportError:
+    re2 = re
+
+# Optional semantic answer cache (sentence-transformers + faiss)
+try:
+    from sentence_transformers import SentenceTransformer
+    import faiss
+except ImportError:
+    SentenceTransformer = faiss = None
 
 # GROQ client & rate-limit exception
 from groq import Groq, RateLimitError
@@ -12,6 +31,7 @@ from groq import Groq, RateLimitError
 # Configure OpenAI-compatible client for Phoenix (pointing at Groq)
 import openai
 import pandas as pd
+import spacy
 from phoenix.evals import run_evals, QAEvaluator, HallucinationEvaluator
 from phoenix.evals.models.openai import OpenAIModel
 
@@ -24,6 +44,7 @@ st.set_page_config(page_title="Groq-SERP Chatbot", layout="wide")
 # Debug mode toggle
 # --------------------------
 debug_mode = st.sidebar.checkbox("Debug mode", value=False)
+llm_catch_all = st.sidebar.checkbox("LLM PII catch-all", value=False)
 
 # -------------
 # Load API keys
@@ -35,109 +56,577 @@ SERPER_API_KEY = st.secrets.get("SERPER_API_KEY") or os.getenv("SERPER_API_KEY")
 openai.api_key = GROQ_API_KEY
 openai.api_base = os.getenv("OPENAI_API_BASE", "https://api.groq.com/openai/v1")
 
-# Initialize Groq chat client
-groq_client = Groq(api_key=GROQ_API_KEY) if GROQ_API_KEY else None
+LLM_MODEL = "llama-3.3-70b-versatile"
+
+# Groq account limits for LLM_MODEL (requests / tokens per minute)
+GROQ_RPM = int(os.getenv("GROQ_RPM", "30"))
+GROQ_TPM = int(os.getenv("GROQ_TPM", "6000"))
+
+# Clients carry HTTP pools, so build them once per process rather than per rerun
+@st.cache_resource
+def _groq_client(api_key):
+    return Groq(api_key=api_key) if api_key else None
+
+
+@st.cache_resource
+def get_evaluators(api_key, base_url):
+    # Model wrapper for Phoenix Evals using OpenAIModel pointed at Groq
+    eval_model = OpenAIModel(
+        api_key=api_key,
+        base_url=base_url,
+        model=LLM_MODEL,
+        temperature=0.0,
+        max_tokens=256
+    )
+    return QAEvaluator(eval_model), HallucinationEvaluator(eval_model)
+
+
+# Initialize Groq chat client & Phoenix evaluators
+groq_client = _groq_client(GROQ_API_KEY)
+qa_eval, hallu_eval = get_evaluators(GROQ_API_KEY, openai.api_base)
 
-# Build a model wrapper for Phoenix Evals using OpenAIModel pointed at Groq
-eval_model = OpenAIModel(
-    api_key=GROQ_API_KEY,
-    base_url=openai.api_base,
-    model="llama-3.3-70b-versatile",
-    temperature=0.0,
-    max_tokens=256
+# ------------------------------------------
+# PII patterns (compiled once, single pass)
+# ------------------------------------------
+EMAIL_PATTERN = r"[\w.+-]+@[\w-]+\.[\w.-]+"
+PHONE_PATTERN = r"\b\d{3}[-.\s]?\d{3}[-.\s]?\d{4}\b"
+ID_PATTERN    = r"\b\d{4,}\b"
+NAME_PATTERN  = r"\b[A-Z][a-z]+ [A-Z][a-z]+\b"
+
+# PII scans stay on the stdlib engine: RE2's \w, \d and \b are ASCII-only and would
+# miss or split non-ASCII addresses such as josé@example.com
+_PII_RE = re.compile(
+    f"(?P<EMAIL>{EMAIL_PATTERN})|(?P<PHONE>{PHONE_PATTERN})|(?P<ID>{ID_PATTERN})"
+)
+# Cheap hint that the text may still hold PII the local passes did not mask
+# (long digit runs, @, phone-like runs, name pairs, or a capitalized word mid-sentence)
+_PII_SUSPECT = re.compile(
+    r"\d{4,}|@|\+?\d[\d\s().-]{7,}|\b[A-Z][a-z]+\s+[A-Z][a-z]+\b|[a-z,;:]\s[A-Z][a-z]+"
 )
+# Deterministic fallback when the LLM catch-all cannot be parsed (adds name pairs)
+_FALLBACK_PII_RE = re.compile(
+    f"(?P<NAME>{NAME_PATTERN})|(?P<EMAIL>{EMAIL_PATTERN})|(?P<PHONE>{PHONE_PATTERN})|(?P<ID>{ID_PATTERN})"
+)
+_PLACEHOLDER_KIND_RE = re.compile(r"<([A-Z]+)_\d+>")
+_JSON_BLOCK_RE = re2.compile(r"(?s)\{.*\}")
 
-# Instantiate Phoenix evaluators with the wrapped model
-qa_eval    = QAEvaluator(eval_model)
-hallu_eval = HallucinationEvaluator(eval_model)
+# ---------------------------------------------------
+# Static prompts (sent first so providers can reuse
+# the cached prefix; volatile content goes last)
+# ---------------------------------------------------
+SYSTEM_PROMPT = (
+    "You are a helpful assistant. Answer the user's question using the "
+    "Serper search results provided with it."
+)
+MASK_SYSTEM_PROMPT = (
+    "Mask any other private or sensitive PII in the user's text, leaving public figures untouched. "
+    "Return only a JSON object with keys `masked_text` and `mapping`."
+)
+
+# Output budgets (tokens estimated at ~4 characters each)
+MASK_MAX_TOKENS   = 1024
+ANSWER_MAX_TOKENS = 4096
+CONTEXT_TOKENS    = 8192
 
 # ----------------
 # Helper functions
 # ----------------
-def serp_search(query):
-    url = "https://google.serper.dev/search"
-    headers = {"X-API-KEY": SERPER_API_KEY}
-    params = {"q": query}
-    resp = requests.get(url, headers=headers, params=params)
+@st.cache_resource
+def _serp_session():
+    # One pooled session per process so the TLS connection to Serper is reused across turns
+    session = requests.Session()
+    session.headers.update({"X-API-KEY": SERPER_API_KEY})
+    session.mount("https://", HTTPAdapter(
+        pool_connections=4, pool_maxsize=16,
+        max_retries=Retry(total=2, backoff_factor=0.2)
+    ))
+    return session
+
+
+SERP_URL = "https://google.serper.dev/search"
+
+def _serp_fetch(query):
+    resp = _serp_session().get(SERP_URL, params={"q": query}, timeout=10)
     resp.raise_for_status()
-    return resp.json(), url, params
+    return orjson.loads(resp.content)
 
 
-def call_llm(prompt, max_tokens=4096):
-    if not groq_client:
-        return "Error: GROQ_API_KEY not provided."
+@st.cache_data(ttl=600, show_spinner=False, max_entries=256)
+def _serp_fetch_cached(query):
+    return _serp_fetch(query)
+
+
+def serp_search(query):
+    # Only cache keyed responses; without a key every call is a fresh attempt
+    fetch = _serp_fetch_cached if SERPER_API_KEY else _serp_fetch
+    return fetch(query), SERP_URL, {"q": query}
+
+
+def _trim_serp(serp_res):
+    # Only what the answer needs: the top organic hits (empty fields dropped) and the answer box
+    trimmed = {"organic": [
+        {k: item[k] for k in ("title", "link", "snippet") if item.get(k)}
+        for item in serp_res.get("organic", [])[:5]
+    ]}
+    answer = serp_res.get("answerBox", {}).get("answer")
+    if answer:
+        trimmed["answerBox"] = {"answer": answer}
+    return trimmed
+
+
+class TokenBucket:
+    # Blocking token bucket on the monotonic clock, safe to share across threads
+    def __init__(self, rate_per_sec, burst):
+        self.rate = rate_per_sec
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def release(self, amount):
+        # Settle a reservation against actual use; negative if it was under-estimated
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+@st.cache_resource
+def _groq_buckets(rpm, tpm):
+    # One pair per process: every session draws from the same account limits
+    return TokenBucket(rpm / 60, rpm), TokenBucket(tpm / 60, tpm)
+
+
+def _stream_text(resp, token_bucket, reserved, prompt_tokens):
+    # Skip role-only, finish and usage chunks that carry no text; Groq reports
+    # usage on the final chunk, which settles the token reservation
+    used = None
+    streamed = 0
+    try:
+        for chunk in resp:
+            usage = getattr(getattr(chunk, "x_groq", None), "usage", None)
+            if usage:
+                used = usage.total_tokens
+            if chunk.choices and chunk.choices[0].delta.content:
+                streamed += len(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+    finally:
+        # A stream cut short (rerun, error) never sees usage: settle on an estimate
+        if used is None:
+            used = prompt_tokens + streamed // 4
+        token_bucket.release(reserved - used)
+
+
+def _complete(messages, max_tokens, stream=False):
+    # Wait client-side for request and token budget instead of round-tripping to a 429
+    request_bucket, token_bucket = _groq_buckets(GROQ_RPM, GROQ_TPM)
+    prompt_tokens = sum(len(m["content"]) for m in messages) // 4
     backoff = 1
+    # Reserve the worst case, then credit back what the reply did not use
+    reserved = min(prompt_tokens + max_tokens, token_bucket.capacity)
     for attempt in range(3):
+        request_bucket.acquire()
+        token_bucket.acquire(reserved)
         try:
             resp = groq_client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=[{"role":"user","content":prompt}],
-                max_tokens=max_tokens
+                model=LLM_MODEL,
+                messages=messages,
+                max_tokens=max_tokens,
+                stream=stream
             )
+            if stream:
+                return _stream_text(resp, token_bucket, reserved, prompt_tokens)
+            if resp.usage:
+                token_bucket.release(reserved - resp.usage.total_tokens)
             return resp.choices[0].message.content
         except RateLimitError:
+            # The rejected request used nothing; the retry reserves afresh
+            token_bucket.release(reserved)
             if attempt < 2:
                 time.sleep(backoff)
                 backoff *= 2
             else:
                 raise
 
+
+@st.cache_data(ttl=24*60*60, max_entries=1024, show_spinner=False)
+def _complete_cached(request_hash, _messages, max_tokens):
+    # Keyed on request_hash; the leading underscore keeps Streamlit from hashing _messages again
+    return _complete(_messages, max_tokens)
+
+
+def call_llm(prompt, max_tokens=4096, system=None, stream=False):
+    if not groq_client:
+        error = "Error: GROQ_API_KEY not provided."
+        return iter([error]) if stream else error
+    messages = [{"role":"user","content":prompt.strip()}]
+    if system:
+        messages.insert(0, {"role":"system","content":system.strip()})
+    if stream:
+        return _complete(messages, max_tokens, stream=True)
+    # Identical requests (model, messages, budget) are served from cache
+    request_hash = hashlib.sha256(orjson.dumps([LLM_MODEL, messages, max_tokens])).hexdigest()
+    return _complete_cached(request_hash, messages, max_tokens)
+
 # ---------------------------------
 # Session state for mapping & counts
 # ---------------------------------
+# Mappings are also kept on disk under a per-browser id in the URL, so a page
+# reload picks up known PII instead of re-masking it (set PII_CACHE_DIR="" to disable)
+# Off unless set: the saved maps hold the raw PII values
+PII_CACHE_DIR = os.getenv("PII_CACHE_DIR", "")
+PII_CACHE_TTL = int(os.getenv("PII_CACHE_TTL", 24*60*60))
+
+def _pii_state_path():
+    if not PII_CACHE_DIR:
+        return None
+    if "pii_session_id" not in st.session_state:
+        sid = st.query_params.get("sid", "")
+        if not re.fullmatch(r"[0-9a-f]{32}", sid):
+            sid = uuid.uuid4().hex
+            st.query_params["sid"] = sid
+        st.session_state.pii_session_id = sid
+    return Path(PII_CACHE_DIR) / f"{st.session_state.pii_session_id}.json"
+
+
+def _is_stale(path):
+    return time.time() - path.stat().st_mtime > PII_CACHE_TTL
+
+
+def _load_pii_state():
+    path = _pii_state_path()
+    if path is None or not path.exists():
+        return {}
+    if _is_stale(path):
+        path.unlink(missing_ok=True)
+        return {}
+    try:
+        data = orjson.loads(path.read_bytes())
+    except orjson.JSONDecodeError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    mapping, counter = data.get("mapping"), data.get("counter")
+    if not isinstance(mapping, dict) or not all(isinstance(v, str) for v in mapping.values()):
+        return {}
+    if not isinstance(counter, dict) or not all(isinstance(n, int) for n in counter.values()):
+        return {}
+    return data
+
+
+def _prune_pii_state(directory):
+    # Drop other sessions' maps once they have gone unused for PII_CACHE_TTL
+    for stale in directory.glob("*.json"):
+        try:
+            if _is_stale(stale):
+                stale.unlink()
+        except FileNotFoundError:
+            pass  # pruned concurrently by another session
+
+
+def _save_pii_state():
+    path = _pii_state_path()
+    if path is None:
+        return
+    path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    path.touch(mode=0o600, exist_ok=True)
+    path.write_bytes(orjson.dumps({
+        "mapping": st.session_state.global_mapping,
+        "counter": st.session_state.placeholder_counter,
+    }))
+    _prune_pii_state(path.parent)
+
+
 if "global_mapping" not in st.session_state:
-    st.session_state.global_mapping = {}
-if "placeholder_counter" not in st.session_state:
-    st.session_state.placeholder_counter = {"NAME":0, "EMAIL":0, "PHONE":0, "ID":0}
-
-def _next_placeholder(kind):
-    st.session_state.placeholder_counter[kind] += 1
-    return f"<{kind}_{st.session_state.placeholder_counter[kind]}>"
-
-# --------------------------------
-# Mask PII: regex + LLM catch-all
-# --------------------------------
-def mask_pii(text):
+    _saved = _load_pii_state()
+    st.session_state.global_mapping = _saved.get("mapping", {})
+    st.session_state.placeholder_counter = {
+        "NAME":0, "EMAIL":0, "PHONE":0, "ID":0, "ORG":0, "LOC":0, "DATE":0, **_saved.get("counter", {})
+    }
+if "value_to_placeholder" not in st.session_state:
+    st.session_state.value_to_placeholder = {v: k for k, v in st.session_state.global_mapping.items()}
+
+def _next_placeholder(kind, counter):
+    # counter is the session's placeholder_counter, bound once by the caller
+    n = counter[kind] = counter.get(kind, 0) + 1
+    return f"<{kind}_{n}>"
+
+# ---------------------------------------
+# Mask PII: regex + NER + LLM catch-all
+# ---------------------------------------
+NER_MODEL = os.getenv("SPACY_MODEL", "en_core_web_sm")
+# Only people: organisations, places and dates are usually the subject of the
+# search itself ("capital of France"), not PII about the user
+_NER_KINDS = {"PERSON": "NAME"}
+
+@st.cache_resource
+def _load_ner():
+    # Loaded once per process; without the model only regex & LLM masking run
+    try:
+        return spacy.load(NER_MODEL, disable=["tagger", "parser", "attribute_ruler", "lemmatizer"])
+    except OSError:
+        return None
+
+
+def _splice_spans(text, spans):
+    # spans are sorted, non-overlapping (start, end, kind); placeholders spliced in one pass
     mapping = st.session_state.global_mapping
-    masked = text
-    # Regex masks
-    for pattern, kind in [
-        (r"[\w.+-]+@[\w-]+\.[\w.-]+", "EMAIL"),
-        (r"\b\d{3}[-.\s]?\d{3}[-.\s]?\d{4}\b", "PHONE"),
-        (r"\b\d{4,}\b", "ID")
-    ]:
-        for match in re.findall(pattern, text):
-            ph = next((k for k,v in mapping.items() if v==match), None) or _next_placeholder(kind)
+    value_to_placeholder = st.session_state.value_to_placeholder
+    counter = st.session_state.placeholder_counter
+    parts, last, turn_map = [], 0, {}
+    for start, end, kind in spans:
+        match = text[start:end]
+        ph = value_to_placeholder.get(match)
+        if ph is None:
+            ph = _next_placeholder(kind, counter)
             mapping[ph] = match
-            masked = masked.replace(match, ph)
-    # LLM catch-all
-    llm_prompt = (
-        "Mask any other private or sensitive PII in this text, leaving public figures untouched.\n"
-        f"Text:\n'''{masked}'''\n"
-        "Return only a JSON object with keys `masked_text` and `mapping`."
-    )
-    raw = call_llm(llm_prompt)
+            value_to_placeholder[match] = ph
+        turn_map[ph] = match
+        parts.append(text[last:start])
+        parts.append(ph)
+        last = end
+    parts.append(text[last:])
+    return "".join(parts), turn_map
+
+
+def _local_mask(text):
+    # Regex & NER masks: collect spans (regex wins on overlap), then splice
+    spans = [(m.start(), m.end(), m.lastgroup) for m in _PII_RE.finditer(text)]
+    nlp = _load_ner()
+    if nlp is not None:
+        regex_spans = list(spans)
+        for ent in nlp(text).ents:
+            kind = _NER_KINDS.get(ent.label_)
+            if kind and not any(s < ent.end_char and ent.start_char < e for s, e, _ in regex_spans):
+                spans.append((ent.start_char, ent.end_char, kind))
+        spans.sort()
+    return _splice_spans(text, spans)
+
+
+def _fallback_mask(text):
+    # Deterministic safe default when the LLM catch-all reply is unusable
+    return _splice_spans(text, [(m.start(), m.end(), m.lastgroup) for m in _FALLBACK_PII_RE.finditer(text)])
+
+
+def _llm_mask(masked):
+    # No session state here, so it is safe to run off the script thread.
+    # The reply echoes the text plus a small mapping, so size the budget to it
+    max_tokens = min(MASK_MAX_TOKENS, 128 + len(masked) // 2)
+    return call_llm(f"Text:\n'''{masked}'''", max_tokens=max_tokens, system=MASK_SYSTEM_PROMPT)
+
+
+def _first_json_block(raw):
+    # Linear scan for the first balanced {...}, ignoring braces inside JSON strings
+    start = raw.find("{")
+    if start < 0:
+        return None
+    depth, in_str, escaped = 0, False, False
+    for i in range(start, len(raw)):
+        c = raw[i]
+        if in_str:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_str = False
+        elif c == '"':
+            in_str = True
+        elif c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                return raw[start:i + 1]
+    return None
+
+
+def _parse_llm_mask(raw):
     try:
-        data = json.loads(raw)
-    except JSONDecodeError:
-        m = re.search(r"\{.*\}", raw, re.DOTALL)
-        if not m:
-            if debug_mode:
-                st.error("Parsing PII mask failed:")
-                st.code(raw)
-            st.stop()
-        data = json.loads(m.group())
+        data = orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        block = _first_json_block(raw)
+        if block is None:
+            m = _JSON_BLOCK_RE.search(raw)
+            block = m.group() if m else None
+        if block is None:
+            return None
+        try:
+            data = orjson.loads(block)
+        except orjson.JSONDecodeError:
+            return None
+    if not isinstance(data, dict) or not isinstance(data.get("masked_text"), str):
+        return None
+    mapping = data.get("mapping")
+    if not isinstance(mapping, dict) or not all(isinstance(v, str) for v in mapping.values()):
+        return None  # orjson already guarantees str keys
+    return data
+
+
+def _merge_llm_mask(raw, masked):
+    data = _parse_llm_mask(raw)
+    if data is None:
+        if debug_mode:
+            st.error("Parsing PII mask failed, using fallback patterns:")
+            st.code(raw)
+        return _fallback_mask(masked)
+    mapping = st.session_state.global_mapping
+    value_to_placeholder = st.session_state.value_to_placeholder
+    counter = st.session_state.placeholder_counter
+    # Reuse the session's placeholder for values seen before and mint new ones from
+    # the session counter, so the LLM's own numbering never collides with ours
+    renames, turn_map = {}, {}
     for ph, orig in data["mapping"].items():
-        if ph not in mapping:
-            mapping[ph] = orig
-    masked = data["masked_text"]
-    turn_map = {ph: mapping[ph] for ph in data["mapping"]}
+        if orig in mapping:
+            continue  # the LLM echoed one of our placeholders
+        canonical = value_to_placeholder.get(orig)
+        if canonical is None:
+            kind = _PLACEHOLDER_KIND_RE.fullmatch(ph)
+            canonical = _next_placeholder(kind.group(1) if kind else "PII", counter)
+            mapping[canonical] = orig
+            value_to_placeholder[orig] = canonical
+        if canonical != ph:
+            renames[ph] = canonical
+        turn_map[canonical] = orig
+    return _multi_replace(data["masked_text"], renames), turn_map
+
+
+def _needs_llm_mask(masked):
+    # With NER loaded the LLM pass is opt-in; without it the LLM covers names
+    if _load_ner() is not None and not llm_catch_all:
+        return False
+    return bool(_PII_SUSPECT.search(masked))
+
+
+def mask_pii(text, on_local_mask=None):
+    # on_local_mask(local_q) is called before the LLM catch-all runs, so the caller
+    # can start work on the locally masked text while the LLM round trip is in flight
+    masked, turn_map = _local_mask(text)
+    if _needs_llm_mask(masked):
+        if on_local_mask:
+            on_local_mask(masked)
+        masked, llm_map = _merge_llm_mask(_llm_mask(masked), masked)
+        turn_map.update(llm_map)
+    if turn_map:
+        _save_pii_state()
     return masked, turn_map
 
 
-def unmask_pii(text, turn_map):
-    for ph, orig in turn_map.items(): text = text.replace(ph, orig)
-    return text
+@st.cache_resource(max_entries=256, show_spinner=False)
+def _alternation(keys):
+    # Longest keys first so <ID_1> never shadows <ID_12>
+    return re2.compile("|".join(re2.escape(k) for k in sorted(keys, key=len, reverse=True)))
+
+
+def _placeholder_re(turn_map):
+    # Same key set -> same compiled pattern, across reruns and sessions
+    return _alternation(tuple(sorted(turn_map)))
+
+
+def _multi_replace(text, mapping, pattern=None):
+    # Every key replaced in one scan; pass pattern to reuse a compiled alternation
+    if not mapping:
+        return text
+    pattern = pattern or _placeholder_re(mapping)
+    return pattern.sub(lambda m: mapping[m.group()], text)
+
+
+def unmask_pii(text, turn_map, pattern=None):
+    return _multi_replace(text, turn_map, pattern)
+
+
+def stream_and_unmask(chunks, turn_map, masked_parts):
+    # Raw masked chunks are collected into masked_parts for the evals
+    if not turn_map:
+        for chunk in chunks:
+            masked_parts.append(chunk)
+            yield chunk
+        return
+    pattern = _placeholder_re(turn_map)
+    hold = max(len(ph) for ph in turn_map) - 1
+    # Every proper prefix of a placeholder: only a tail in this set needs holding back
+    prefixes = {ph[:i] for ph in turn_map for i in range(1, len(ph))}
+    buf = ""
+    for chunk in chunks:
+        masked_parts.append(chunk)
+        buf += chunk
+        # Hold back the longest tail that could still grow into a placeholder
+        # (at most `hold` characters); flush and unmask everything before it
+        keep = next((k for k in range(min(hold, len(buf)), 0, -1) if buf[-k:] in prefixes), 0)
+        cut = len(buf) - keep
+        if cut == 0:
+            continue
+        # A complete placeholder straddling the cut is flushed whole
+        for m in pattern.finditer(buf, max(0, cut - hold)):
+            if m.start() < cut < m.end():
+                cut = m.end()
+                break
+        head, buf = buf[:cut], buf[cut:]
+        yield unmask_pii(head, turn_map, pattern)
+    if buf:
+        yield unmask_pii(buf, turn_map, pattern)
+
+# ---------------------------------------------
+# Semantic answer cache (masked queries only)
+# ---------------------------------------------
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SEMANTIC_CACHE_TTL = 60*60
+
+@st.cache_resource
+def _load_embedder():
+    if SentenceTransformer is None or faiss is None:
+        return None
+    return SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+
+if "entries" not in st.session_state.get("semantic_cache", {}):
+    st.session_state.semantic_cache = {"index": None, "entries": []}
+
+def _semantic_lookup(masked_q, turn_map):
+    # Returns (fresh cache entry or None, query embedding or None); an entry only
+    # matches if it was asked about exactly the same masked values as this turn
+    embedder = _load_embedder()
+    if embedder is None:
+        return None, None
+    vec = embedder.encode([masked_q], normalize_embeddings=True).astype("float32")
+    cache = st.session_state.semantic_cache
+    if cache["index"] is None or not cache["index"].ntotal:
+        return None, vec
+    now = time.time()
+    scores, ids = cache["index"].search(vec, min(8, cache["index"].ntotal))
+    for score, i in zip(scores[0], ids[0]):
+        if score < SEMANTIC_CACHE_THRESHOLD:
+            break
+        entry = cache["entries"][i]
+        if now - entry["at"] < SEMANTIC_CACHE_TTL and entry["turn_map"] == turn_map:
+            return entry, vec
+    return None, vec
+
+
+def _semantic_store(vec, masked_ans, serp, turn_map):
+    cache = st.session_state.semantic_cache
+    now = time.time()
+    live = [e for e in cache["entries"] if now - e["at"] < SEMANTIC_CACHE_TTL]
+    if cache["index"] is None or len(live) < len(cache["entries"]):
+        # Drop expired entries by rebuilding the (small, flat) index
+        cache["index"] = faiss.IndexFlatIP(vec.shape[1])
+        for e in live:
+            cache["index"].add(e["vec"])
+        cache["entries"] = live
+    cache["index"].add(vec)
+    cache["entries"].append({
+        "vec": vec, "answer": masked_ans, "serp": serp, "turn_map": dict(turn_map), "at": now,
+    })
 
 # --------------------
 # Single-turn holder
@@ -152,34 +641,80 @@ def on_enter():
     user_input = st.session_state.user_input.strip()
     if not user_input:
         return
-    # Mask & Search
-    masked_q, turn_map = mask_pii(user_input)
-    serp_res, serp_url, serp_params = serp_search(masked_q)
-    # Generate masked answer
-    llm_prompt = (
-        "You are a helpful assistant. Use these Serper results:\n"
-        f"{json.dumps(serp_res)}\n\n"
-        f"Question: {masked_q}"
-    )
-    masked_ans = call_llm(llm_prompt)
+    # Processed in the script body so the answer can stream into the page
+    st.session_state.pending_input = user_input
+    st.session_state.user_input = ""
+
+# -------------------------
+# Run one turn
+# -------------------------
+def run_turn(user_input):
+    # Mask & Search: search on the locally masked query while the LLM catch-all runs
+    # Pools are per turn so one session's slow calls never queue behind another's
+    pool = ThreadPoolExecutor(max_workers=1)
+    speculative = {}
+    def prefetch(local_q):
+        speculative[local_q.strip()] = pool.submit(serp_search, local_q)
+    masked_q, turn_map = mask_pii(user_input, on_local_mask=prefetch)
+    pool.shutdown(wait=False)  # a dropped speculative search finishes on its own
+    hit, query_vec = _semantic_lookup(masked_q, turn_map)
+    # Only usable if the LLM did not mask more than regex & NER did
+    serp_future = speculative.get(masked_q.strip())
+    if hit is not None:
+        # A paraphrase was answered recently: reuse its search results and answer
+        serp_for_llm, serp_url, serp_params = hit["serp"]
+    else:
+        serp_res, serp_url, serp_params = serp_future.result() if serp_future else serp_search(masked_q)
+        serp_for_llm = _trim_serp(serp_res)
+    # Serialize the trimmed results once for the prompt, evals and debug view
+    serp_json = orjson.dumps(serp_for_llm).decode()
+    # Stream the answer, unmasking as it arrives
+    st.subheader("📢 Final Answer")
+    if hit is not None:
+        # Same masked values as this turn, so the entry's own map unmasks it
+        chunks, unmask_map = iter([hit["answer"]]), hit["turn_map"]
+    else:
+        llm_prompt = (
+            f"Search results (JSON):\n{serp_json}\n\n"
+            f"Question: {masked_q}"
+        )
+        prompt_tokens = (len(SYSTEM_PROMPT) + len(llm_prompt)) // 4
+        max_tokens = max(256, min(ANSWER_MAX_TOKENS, CONTEXT_TOKENS - prompt_tokens))
+        chunks = call_llm(llm_prompt, max_tokens=max_tokens, system=SYSTEM_PROMPT, stream=True)
+        unmask_map = turn_map
+    masked_parts = []
+    final_ans = st.write_stream(stream_and_unmask(chunks, unmask_map, masked_parts))
+    masked_ans = "".join(masked_parts)
+    if hit is None and query_vec is not None and groq_client:
+        _semantic_store(query_vec, masked_ans, (serp_for_llm, serp_url, serp_params), turn_map)
     # Phoenix eval DataFrames
-    qa_df = pd.DataFrame([
-        {"input": masked_q, "output": masked_ans, "reference": item.get("snippet", "")} 
-        for item in serp_res.get("organic", [])
-    ])
-    hallu_df = pd.DataFrame([
-        {"input": masked_q, "output": masked_ans, "context": json.dumps(serp_res)}
-    ])
-    qa_metrics    = run_evals(dataframe=qa_df,    evaluators=[qa_eval],    provide_explanation=True)
-    hallu_metrics = run_evals(dataframe=hallu_df, evaluators=[hallu_eval], provide_explanation=True)
-    # Unmask & store final answer
-    final_ans = unmask_pii(masked_ans, turn_map)
+    qa_df = pd.DataFrame.from_records(
+        ({"input": masked_q, "output": masked_ans, "reference": item["snippet"]}
+         for item in serp_for_llm["organic"] if "snippet" in item),
+        columns=["input", "output", "reference"]
+    )
+    hallu_df = pd.DataFrame.from_records(
+        [{"input": masked_q, "output": masked_ans, "context": serp_json}]
+    )
+    # Both evals are independent Groq fan-outs; run them side by side
+    # Phoenix runs evals synchronously off the main thread, so fan the QA rows out here
+    with ThreadPoolExecutor(max_workers=len(qa_df) + 1) as pool:
+        qa_futures   = [
+            pool.submit(run_evals, dataframe=qa_df.iloc[[i]], evaluators=[qa_eval], provide_explanation=True)
+            for i in range(len(qa_df))
+        ]
+        hallu_future = pool.submit(run_evals, dataframe=hallu_df, evaluators=[hallu_eval], provide_explanation=True)
+        qa_results = [f.result()[0] for f in qa_futures]
+        qa_metrics = [pd.concat(qa_results) if qa_results else pd.DataFrame()]
+        hallu_metrics = hallu_future.result()
+    # Store final answer
     st.session_state.last_turn = {
         "final_answer": final_ans,
+        "serp_request": {"url": serp_url, "params": serp_params},
+        "serp_response": serp_for_llm,
         "qa_metrics": qa_metrics,
         "hallu_metrics": hallu_metrics
     }
-    st.session_state.user_input = ""
 
 # --------------------------
 # Input widget
@@ -190,14 +725,24 @@ st.text_input(
     placeholder="Type your message and press Enter…"
 )
 
+pending_input = st.session_state.pop("pending_input", None)
+if pending_input:
+    run_turn(pending_input)
+
 # --------------------------
 # Display response + metrics
 # --------------------------
 turn = st.session_state.last_turn
 if turn:
-    st.subheader("📢 Final Answer")
-    st.write(turn["final_answer"])
+    if not pending_input:
+        # A freshly run turn has already streamed its answer above
+        st.subheader("📢 Final Answer")
+        st.write(turn["final_answer"])
     if debug_mode:
+        with st.sidebar.expander("SERP Request", expanded=False):
+            st.json(turn["serp_request"])
+        with st.sidebar.expander("SERP Response", expanded=False):
+            st.json(turn["serp_response"], expanded=False)
         st.markdown("---")
         st.subheader("📊 QA Metrics")
         df_qa = turn["qa_metrics"].results if hasattr(turn["qa_metrics"], 'results') else pd.DataFrame(turn["qa_metrics"])